@@ -0,0 +1,115 @@
+"""Compare per-request commits against the group-commit path for favorites.
+
+    $ python benchmarks/group_commit.py --threads 16 --requests 200
+
+Runs against a throwaway SQLite file unless DATABASE_URL is already set.
+The tuned SQLite profile runs WAL with synchronous=NORMAL, where commits
+do not fsync at all and there is nothing for group commit to amortize, so
+the benchmark pins synchronous=FULL (see --synchronous): every commit then
+pays a real fsync. --tmpdir should point at a disk, not a tmpfs.
+
+Each request thread here plays a gunicorn thread (gthread). With sync
+workers a process serves one request at a time, so every batch has a
+single operation and group commit only adds max_delay_ms of latency.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100, help='requests per thread')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay-ms', type=float, default=5)
+    parser.add_argument('--synchronous', default='FULL', help='SQLite PRAGMA synchronous for the run')
+    parser.add_argument('--tmpdir', default=None, help='where the throwaway SQLite file goes')
+    return parser.parse_args()
+
+
+args = parse_args()
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(dir=args.tmpdir), 'bench.db')
+
+from sqlalchemy import event  # noqa: E402
+from app import app  # noqa: E402
+from models import db, User, People  # noqa: E402
+from group_commit import GroupCommitter  # noqa: E402
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        # Registered after the SQLite profile's own connect hook, so it wins
+        @event.listens_for(db.engine, 'connect')
+        def pin_synchronous(dbapi_connection, connection_record):
+            dbapi_connection.execute('PRAGMA synchronous=%s' % args.synchronous)
+        db.engine.dispose()
+
+
+def setup_data(n_people):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(username='bench', email='bench@example.com', password='x', is_active=True))
+        db.session.add_all([People(name='person %d' % i) for i in range(n_people)])
+        db.session.commit()
+
+
+def run(threads, requests_per_thread):
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        client = app.test_client()
+        for i in range(requests_per_thread):
+            people_id = (offset * requests_per_thread + i) + 1
+            start = time.perf_counter()
+            resp = client.post('/favorite/people/%d' % people_id, json={'user_id': 1})
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code != 201:
+                    errors.append(resp.status_code)
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        'ops/s': count / total,
+        'p50 ms': latencies[count // 2] * 1000,
+        'p99 ms': latencies[min(count - 1, int(count * 0.99))] * 1000,
+        'errors': len(errors),
+    }
+
+
+def main():
+    n_people = args.threads * args.requests
+    modes = [
+        ('per-request commit', None),
+        ('group commit', GroupCommitter(app, max_batch=args.max_batch, max_delay_ms=args.max_delay_ms)),
+    ]
+    for name, committer in modes:
+        setup_data(n_people)
+        app.extensions.pop('group_commit', None)
+        if committer is not None:
+            app.extensions['group_commit'] = committer
+        result = run(args.threads, args.requests)
+        print('%-20s ' % name + '  '.join('%s=%.1f' % (k, v) for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
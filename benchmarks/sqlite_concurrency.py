@@ -0,0 +1,99 @@
+"""Read/write throughput of the SQLite fallback with and without the tuned profile.
+
+    $ python benchmarks/sqlite_concurrency.py --workers 4 --seconds 5
+
+Each worker is a separate process (like a gunicorn worker) hitting the app
+through the test client: mostly GET /people/<id> plus PUT /people/<id>
+with the given write ratio.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+N_PEOPLE = 500
+
+
+def worker(db_url, profile, seconds, write_ratio, results):
+    os.environ['DATABASE_URL'] = db_url
+    os.environ['SQLITE_PROFILE'] = profile
+    sys.path.insert(0, SRC)
+    from app import app
+
+    client = app.test_client()
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        people_id = random.randint(1, N_PEOPLE)
+        try:
+            if random.random() < write_ratio:
+                resp = client.put('/people/%d' % people_id, json={'eye_color': random.choice(['blue', 'brown'])})
+                writes += 1
+            else:
+                resp = client.get('/people/%d' % people_id)
+                reads += 1
+            if resp.status_code != 200:
+                errors += 1
+        except Exception:
+            # "database is locked" surfaces as an OperationalError
+            errors += 1
+    results.put((reads, writes, errors))
+
+
+def setup(db_url, profile):
+    # journal_mode=WAL is stored in the database file, so the file has to be
+    # created under the profile being measured
+    os.environ['DATABASE_URL'] = db_url
+    os.environ['SQLITE_PROFILE'] = profile
+    sys.path.insert(0, SRC)
+    from app import app
+    from models import db, People
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([People(name='person %d' % i, eye_color='blue') for i in range(N_PEOPLE)])
+        db.session.commit()
+        mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+    print('%-8s journal_mode=%s' % (profile, mode))
+
+
+def run(profile, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db_url = 'sqlite:///' + path
+    ctx = multiprocessing.get_context('spawn')
+    init = ctx.Process(target=setup, args=(db_url, profile))
+    init.start()
+    init.join()
+
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(db_url, profile, args.seconds, args.write_ratio, results))
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    totals = [0, 0, 0]
+    for _ in procs:
+        for i, value in enumerate(results.get()):
+            totals[i] += value
+    for p in procs:
+        p.join()
+    reads, writes, errors = totals
+    print('%-8s reads/s=%-8.0f writes/s=%-8.0f errors=%d' % (
+        profile, reads / args.seconds, writes / args.seconds, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+    for profile in ('off', 'tuned'):
+        run(profile, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""hash-partition favorite by user_id
+
+Revision ID: 7f3a1c9e2b4d
+Revises: dc59bf955c78
+Create Date: 2026-10-19 10:12:41.208331
+
+On PostgreSQL the favorite table is rebuilt as a HASH (user_id) partitioned
+table with FAVORITE_PARTITIONS partitions (default 8), so every per-user
+query is pruned to a single partition. Other databases only get the
+user_id index.
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3a1c9e2b4d'
+down_revision = 'dc59bf955c78'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'id, user_id, vehicle_id, people_id, planet_id'
+FOREIGN_KEYS = ('user_id', 'vehicle_id', 'people_id', 'planet_id')
+
+
+def rename_constraints(table):
+    # Frees the default names (favorite_pkey, favorite_<column>_fkey) for the
+    # table that replaces this one; otherwise PostgreSQL picks *_fkey1
+    op.execute('ALTER TABLE %s RENAME CONSTRAINT favorite_pkey TO %s_pkey' % (table, table))
+    for column in FOREIGN_KEYS:
+        op.execute('ALTER TABLE %s RENAME CONSTRAINT favorite_%s_fkey TO %s_%s_fkey' % (table, column, table, column))
+
+
+def drop_foreign_keys(table):
+    # Renaming a partitioned table's constraint leaves the partitions' copies
+    # under the old name, so the foreign keys of the table being dropped are
+    # dropped up front instead
+    for column in FOREIGN_KEYS:
+        op.execute('ALTER TABLE %s DROP CONSTRAINT favorite_%s_fkey' % (table, column))
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index('ix_favorite_user_id', 'favorite', ['user_id'], unique=False)
+        return
+
+    partitions = int(os.getenv('FAVORITE_PARTITIONS', 8))
+    op.execute('ALTER TABLE favorite RENAME TO favorite_unpartitioned')
+    rename_constraints('favorite_unpartitioned')
+    # Keep the id sequence alive when the old table is dropped
+    op.execute('ALTER SEQUENCE favorite_id_seq OWNED BY NONE')
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE favorite (
+            id INTEGER NOT NULL DEFAULT nextval('favorite_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            vehicle_id INTEGER REFERENCES vehicle (id),
+            people_id INTEGER REFERENCES people (id),
+            planet_id INTEGER REFERENCES planet (id),
+            CONSTRAINT favorite_pkey PRIMARY KEY (id, user_id)
+        ) PARTITION BY HASH (user_id)
+    """)
+    for remainder in range(partitions):
+        op.execute('CREATE TABLE favorite_p%d PARTITION OF favorite FOR VALUES WITH (MODULUS %d, REMAINDER %d)'
+                   % (remainder, partitions, remainder))
+    op.create_index('ix_favorite_user_id', 'favorite', ['user_id'], unique=False)
+    op.execute('INSERT INTO favorite (%s) SELECT %s FROM favorite_unpartitioned' % (COLUMNS, COLUMNS))
+    op.execute('ALTER SEQUENCE favorite_id_seq OWNED BY favorite.id')
+    op.execute('DROP TABLE favorite_unpartitioned')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_favorite_user_id', table_name='favorite')
+        return
+
+    op.execute('ALTER TABLE favorite RENAME TO favorite_partitioned')
+    op.execute('ALTER TABLE favorite_partitioned RENAME CONSTRAINT favorite_pkey TO favorite_partitioned_pkey')
+    drop_foreign_keys('favorite_partitioned')
+    op.execute('ALTER INDEX ix_favorite_user_id RENAME TO ix_favorite_partitioned_user_id')
+    op.execute('ALTER SEQUENCE favorite_id_seq OWNED BY NONE')
+    op.create_table('favorite',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('favorite_id_seq')"), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('vehicle_id', sa.Integer(), nullable=True),
+    sa.Column('people_id', sa.Integer(), nullable=True),
+    sa.Column('planet_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['people_id'], ['people.id'], ),
+    sa.ForeignKeyConstraint(['planet_id'], ['planet.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['vehicle_id'], ['vehicle.id'], ),
+    sa.PrimaryKeyConstraint('id', name='favorite_pkey')
+    )
+    op.execute('INSERT INTO favorite (%s) SELECT %s FROM favorite_partitioned' % (COLUMNS, COLUMNS))
+    op.execute('ALTER SEQUENCE favorite_id_seq OWNED BY favorite.id')
+    op.execute('DROP TABLE favorite_partitioned')
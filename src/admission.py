@@ -0,0 +1,236 @@
+import fcntl
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from flask import g, jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# Never limited, so load balancer probes keep working under load
+EXEMPT_ENDPOINTS = (None, 'static', 'healthz', 'readyz')
+
+# List endpoints that scan whole tables; each gets its own concurrency cap
+EXPENSIVE_ENDPOINTS = ('get_all_favorites', 'get_all_people', 'get_all_planets', 'get_all_vehicles', 'get_all_users')
+
+
+class LocalBackend:
+    """Counters for a single process (threaded workers, dev server)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = {}
+
+    def take_token(self, key, rate, burst):
+        # Returns 0 when a token was taken, otherwise seconds until one is free
+        with self._lock:
+            return _take_token(self._buckets, key, rate, burst, time.time())
+
+    def acquire_slot(self, name, limit):
+        with self._lock:
+            if self._slots.get(name, 0) >= limit:
+                return False
+            self._slots[name] = self._slots.get(name, 0) + 1
+            return True
+
+    def release_slot(self, name):
+        with self._lock:
+            self._slots[name] = max(0, self._slots.get(name, 0) - 1)
+
+
+class FileBackend:
+    """Counters shared by every worker on the host, one small file per key.
+
+    Each client's token bucket and each route's slot count lives in its own
+    file under `directory`, locked with flock, so requests only queue behind
+    others for the same client or route. Slots are recorded per pid, so the
+    slots of a worker that died mid request are reclaimed on the next write.
+    """
+
+    def __init__(self, directory, prune_every=1000):
+        self.directory = directory
+        self.prune_every = prune_every
+        self._calls = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, '%s-%s.json' % (kind, hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def _update(self, path, fn):
+        # fn(state) -> (result, new_state); the file is only rewritten when
+        # the state changed, so a request polling a full route just reads
+        with open(path, 'a+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0)
+                raw = fh.read()
+                state = json.loads(raw) if raw else None
+                result, new_state = fn(state)
+                if new_state != state:
+                    fh.seek(0)
+                    fh.truncate()
+                    json.dump(new_state, fh)
+                    fh.flush()
+                return result
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _prune(self, rate, burst):
+        # A bucket untouched for burst/rate seconds is full again, i.e. back
+        # at the default, so its file can go
+        self._calls += 1
+        if self._calls % self.prune_every:
+            return
+        cutoff = time.time() - burst / rate
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('bucket-') and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def take_token(self, key, rate, burst):
+        def take(state):
+            buckets = {key: state} if state else {}
+            wait = _take_token(buckets, key, rate, burst, time.time())
+            return wait, list(buckets[key])
+        wait = self._update(self._path('bucket', key), take)
+        self._prune(rate, burst)
+        return wait
+
+    def acquire_slot(self, name, limit):
+        pid = str(os.getpid())
+
+        def acquire(state):
+            holders = {p: n for p, n in (state or {}).items() if n > 0 and _alive(int(p))}
+            if sum(holders.values()) >= limit:
+                return False, holders
+            holders[pid] = holders.get(pid, 0) + 1
+            return True, holders
+        return self._update(self._path('slots', name), acquire)
+
+    def release_slot(self, name):
+        pid = str(os.getpid())
+
+        def release(state):
+            holders = dict(state or {})
+            holders[pid] = max(0, holders.get(pid, 0) - 1)
+            return None, holders
+        self._update(self._path('slots', name), release)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _take_token(buckets, key, rate, burst, now):
+    tokens, updated = buckets.get(key, (burst, now))
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        buckets[key] = (tokens - 1, now)
+        wait = 0
+    else:
+        buckets[key] = (tokens, now)
+        wait = (1 - tokens) / rate
+    if len(buckets) > 10000:
+        # Drop clients whose bucket has refilled; they are back at the default
+        for other, (t, u) in list(buckets.items()):
+            if t + (now - u) * rate >= burst:
+                del buckets[other]
+    return wait
+
+
+def parse_limits(value):
+    # "get_all_people=8,get_all_favorites=2" -> {'get_all_people': 8, ...}
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            endpoint, limit = item.split('=', 1)
+            limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+def _reject(status, msg, retry_after):
+    response = jsonify({"msg": msg})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+def setup_admission(app):
+    app.config.setdefault('ADMISSION_CONTROL', os.getenv('ADMISSION_CONTROL', '0') == '1')
+    if not app.config['ADMISSION_CONTROL']:
+        return
+    app.config.setdefault('ADMISSION_BACKEND', os.getenv('ADMISSION_BACKEND', 'local'))
+    app.config.setdefault('ADMISSION_STATE_DIR', os.getenv('ADMISSION_STATE_DIR', '/tmp/starwars-admission'))
+    # Proxies in front of the app that append to X-Forwarded-For. Heroku's
+    # and Render's routers are one hop; without this every client would
+    # share the router's address (and its token bucket).
+    behind_router = os.getenv('DYNO') or os.getenv('RENDER')
+    app.config.setdefault('ADMISSION_PROXY_HOPS', int(os.getenv('ADMISSION_PROXY_HOPS', 1 if behind_router else 0)))
+    app.config.setdefault('RATE_LIMIT_PER_SEC', float(os.getenv('RATE_LIMIT_PER_SEC', 20)))
+    app.config.setdefault('RATE_LIMIT_BURST', float(os.getenv('RATE_LIMIT_BURST', 40)))
+    app.config.setdefault('ROUTE_CONCURRENCY', int(os.getenv('ROUTE_CONCURRENCY', 4)))
+    app.config.setdefault('ROUTE_CONCURRENCY_OVERRIDES', parse_limits(os.getenv('ROUTE_CONCURRENCY_OVERRIDES')))
+    # How long a request may wait for a slot before it is shed with a 503
+    app.config.setdefault('ADMISSION_QUEUE_TIMEOUT_MS', float(os.getenv('ADMISSION_QUEUE_TIMEOUT_MS', 250)))
+
+    if app.config['ADMISSION_PROXY_HOPS']:
+        # Only the entries the trusted proxies appended are used; anything
+        # further left in X-Forwarded-For was written by the client
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['ADMISSION_PROXY_HOPS'])
+
+    if app.config['ADMISSION_BACKEND'] == 'file':
+        backend = FileBackend(app.config['ADMISSION_STATE_DIR'])
+    else:
+        backend = LocalBackend()
+    app.extensions['admission'] = backend
+
+    limits = {endpoint: app.config['ROUTE_CONCURRENCY'] for endpoint in EXPENSIVE_ENDPOINTS}
+    limits.update(app.config['ROUTE_CONCURRENCY_OVERRIDES'])
+    rate = app.config['RATE_LIMIT_PER_SEC']
+    burst = app.config['RATE_LIMIT_BURST']
+    budget = app.config['ADMISSION_QUEUE_TIMEOUT_MS'] / 1000.0
+
+    @app.before_request
+    def admit():
+        if request.endpoint in EXEMPT_ENDPOINTS or request.environ.get('starwars.warmup'):
+            return None
+        wait = backend.take_token(request.remote_addr or 'unknown', rate, burst)
+        if wait:
+            return _reject(429, "Too many requests", wait)
+
+        limit = limits.get(request.endpoint)
+        if limit is None:
+            return None
+        deadline = time.monotonic() + budget
+        while not backend.acquire_slot(request.endpoint, limit):
+            if time.monotonic() >= deadline:
+                return _reject(503, "Server busy, try again later", 1)
+            time.sleep(0.005)
+        g.admission_slot = request.endpoint
+        return None
+
+    @app.after_request
+    def hold_for_stream(response):
+        # teardown_request runs as soon as the view returns, before a streamed
+        # body (e.g. /favorites) has run a single query: keep the slot until
+        # the response is closed instead
+        slot = g.pop('admission_slot', None) if response.is_streamed else None
+        if slot is not None:
+            response.call_on_close(lambda: backend.release_slot(slot))
+        return response
+
+    @app.teardown_request
+    def release(exc):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            backend.release_slot(slot)
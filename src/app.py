@@ -1,9 +1,21 @@
 import os
-from flask import Flask, request, jsonify, url_for
+import json
+from flask import Flask, Response, request, jsonify, url_for, stream_with_context
 from flask_migrate import Migrate
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
+from utils import APIException, generate_sitemap, cached_response, parse_id_list, get_many, parse_expand, serialize_favorites, \
+    stream_favorites, annotate_favorites, parse_user_arg
 from admin import setup_admin
+from catalogue_import import catalogue_cli
+from provision import template_cli
+from sqlite_profile import setup_sqlite_profile
+from admission import setup_admission
+from profiling import setup_profiling
+from idempotency import setup_idempotency, idempotent
+from warmup import setup_health, warm_up
+from events import setup_events, publish_event
+from group_commit import setup_group_commit, insert_favorite, delete_favorite
+from openapi import build_openapi
 from models import db, User, People, Planet, Favorite, Vehicle
 
 app = Flask(__name__)
@@ -18,9 +30,31 @@ else:
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 MIGRATE = Migrate(app, db)
+# `flask catalogue import ...` y `flask template ...` junto a los comandos `flask db`
+app.cli.add_command(catalogue_cli)
+app.cli.add_command(template_cli)
 db.init_app(app)
+# WAL, busy_timeout, mmap... cuando se usa SQLite (SQLITE_PROFILE=off para desactivarlo)
+setup_sqlite_profile(app)
 CORS(app)
+# ADMISSION_CONTROL=1 activa el rate limit por cliente y el límite de concurrencia por ruta
+setup_admission(app)
+# PROFILE_TOKEN / PROFILE_SAMPLE_RATE activan el perfilado por petición
+setup_profiling(app)
 setup_admin(app)
+# GROUP_COMMIT_ENABLED=1 agrupa las escrituras de favoritos en transacciones compartidas
+# (solo sirve con workers gthread/gevent; con workers sync cada lote tiene una sola escritura)
+setup_group_commit(app)
+# Idempotency-Key en los POST (IDEMPOTENCY_BACKEND=memory|file|off)
+setup_idempotency(app)
+# /healthz (liveness) y /readyz (readiness, tras el warm-up del worker)
+setup_health(app)
+# /events: cambios en vivo por SSE (EVENTS_TRANSPORT=local|file|off)
+setup_events(app)
+
+# Relaciones de Favorite que se cargan en bloque y las que se pueden expandir
+FAVORITE_RELATED = {'user': User, 'people': People, 'planet': Planet, 'vehicle': Vehicle}
+FAVORITE_EXPAND = ('people', 'planet', 'vehicle')
 
 # Manejar/serializar errores como un objeto JSON
 @app.errorhandler(APIException)
@@ -28,9 +62,15 @@ def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # Generar un sitemap con todos los endpoints-------------------------
+# El índice y la especificación se generan una sola vez y se sirven con ETag
 @app.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return cached_response('sitemap', lambda: generate_sitemap(app), 'text/html')
+
+# Especificación OpenAPI generada a partir de las rutas y los modelos
+@app.route('/openapi.json')
+def openapi_spec():
+    return cached_response('openapi', lambda: json.dumps(build_openapi(app), sort_keys=True), 'application/json')
 
 #--------*********DIVIDO POR MODELOS PARA IMPLEMENTAR ENDPOINT********
 #----------------------------personajes-------------------------------
@@ -38,8 +78,17 @@ def sitemap():
 # Obtener todos los personajes
 @app.route('/people', methods=['GET'])
 def get_all_people():
-    all_people = People.query.all()
-    return jsonify([person.serialize() for person in all_people]), 200
+    # ?ids=1,2,3 devuelve solo esos personajes con una única consulta
+    # ?for_user=<id> marca cada fila con is_favorite para ese usuario
+    if 'ids' in request.args:
+        all_people = get_many(People, parse_id_list(request.args['ids']))
+    else:
+        all_people = People.query.all()
+    results = [person.serialize() for person in all_people]
+    for_user = parse_user_arg(request.args.get('for_user'))
+    if for_user is not None:
+        annotate_favorites(results, 'people', for_user)
+    return jsonify(results), 200
 
 # Obtener un personaje específico por ID---------------------------
 
@@ -51,6 +100,7 @@ def get_person(people_id):
     return jsonify(person.serialize()), 200
 # Crear un nuevo personaje
 @app.route('/people', methods=['POST'])
+@idempotent
 def create_person():
     name = request.json.get('name')
     gender = request.json.get('gender')
@@ -65,6 +115,7 @@ def create_person():
     )
     db.session.add(new_person)
     db.session.commit()
+    publish_event('people', 'created', new_person.serialize())
     return jsonify(new_person.serialize()), 201
 
 # Actualizar un personaje específico por ID
@@ -85,6 +136,7 @@ def update_person(people_id):
     person.eye_color = eye_color if eye_color else person.eye_color
 
     db.session.commit()
+    publish_event('people', 'updated', person.serialize())
     return jsonify(person.serialize()), 200
 
 # Eliminar un personaje específico por ID
@@ -96,6 +148,7 @@ def delete_person(people_id):
     
     db.session.delete(person)
     db.session.commit()
+    publish_event('people', 'deleted', {"id": people_id})
     return jsonify({"msg": "Person deleted"}), 200
 
 #----------------------------planetas-------------------------------
@@ -103,8 +156,15 @@ def delete_person(people_id):
 # Obtener todos los planetas
 @app.route('/planets', methods=['GET'])
 def get_all_planets():
-    all_planets = Planet.query.all()
-    return jsonify([planet.serialize() for planet in all_planets]), 200
+    if 'ids' in request.args:
+        all_planets = get_many(Planet, parse_id_list(request.args['ids']))
+    else:
+        all_planets = Planet.query.all()
+    results = [planet.serialize() for planet in all_planets]
+    for_user = parse_user_arg(request.args.get('for_user'))
+    if for_user is not None:
+        annotate_favorites(results, 'planet', for_user)
+    return jsonify(results), 200
 
 # Obtener un planeta específico por ID--------------------------------
 
@@ -116,6 +176,7 @@ def get_planet(planet_id):
     return jsonify(planet.serialize()), 200
 # Crear un nuevo planeta
 @app.route('/planets', methods=['POST'])
+@idempotent
 def create_planet():
     name = request.json.get('name')
     climate = request.json.get('climate')
@@ -130,6 +191,7 @@ def create_planet():
     )
     db.session.add(new_planet)
     db.session.commit()
+    publish_event('planet', 'created', new_planet.serialize())
     return jsonify(new_planet.serialize()), 201
 
 # Actualizar un planeta específico por ID
@@ -150,6 +212,7 @@ def update_planet(planet_id):
     planet.population = population if population else planet.population
 
     db.session.commit()
+    publish_event('planet', 'updated', planet.serialize())
     return jsonify(planet.serialize()), 200
 
 # Eliminar un planeta específico por ID
@@ -161,6 +224,7 @@ def delete_planet(planet_id):
 
     db.session.delete(planet)
     db.session.commit()
+    publish_event('planet', 'deleted', {"id": planet_id})
     return jsonify({"msg": "Planet deleted"}), 200
     
 
@@ -184,6 +248,7 @@ def get_user(user_id):
 # Crear un nuevo usuario-----------------------------------
 
 @app.route('/users', methods=['POST'])
+@idempotent
 def create_user():
     username = request.json.get('username')
     email = request.json.get('email')
@@ -200,6 +265,7 @@ def create_user():
     )
     db.session.add(new_user)
     db.session.commit()
+    publish_event('user', 'created', new_user.serialize(), user_id=new_user.id)
     return jsonify(new_user.serialize()), 201
 
 
@@ -219,6 +285,7 @@ def update_user(user_id):
     user.password = password if password else user.password
 
     db.session.commit()
+    publish_event('user', 'updated', user.serialize(), user_id=user_id)
     return jsonify(user.serialize()), 200
 
 # Eliminar un usuario específico por ID
@@ -230,6 +297,7 @@ def delete_user(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    publish_event('user', 'deleted', {"id": user_id}, user_id=user_id)
     return jsonify({"msg": "User deleted"}), 200
 
 #----------------------------vehículos-------------------------------
@@ -237,8 +305,15 @@ def delete_user(user_id):
 # Obtener todos los vehículos
 @app.route('/vehicles', methods=['GET'])
 def get_all_vehicles():
-    all_vehicles = Vehicle.query.all()
-    return jsonify([vehicles.serialize() for vehicles in all_vehicles]), 200
+    if 'ids' in request.args:
+        all_vehicles = get_many(Vehicle, parse_id_list(request.args['ids']))
+    else:
+        all_vehicles = Vehicle.query.all()
+    results = [vehicles.serialize() for vehicles in all_vehicles]
+    for_user = parse_user_arg(request.args.get('for_user'))
+    if for_user is not None:
+        annotate_favorites(results, 'vehicle', for_user)
+    return jsonify(results), 200
 
 # Obtener un vehículo específico por ID
 @app.route('/vehicles/<int:vehicle_id>', methods=['GET'])
@@ -250,6 +325,7 @@ def get_vehicle(vehicle_id):
 
 # Crear un nuevo vehículo
 @app.route('/vehicles', methods=['POST'])
+@idempotent
 def create_vehicle():
     name = request.json.get('name')
     model = request.json.get('model')
@@ -268,6 +344,7 @@ def create_vehicle():
     )
     db.session.add(new_vehicle)
     db.session.commit()
+    publish_event('vehicle', 'created', new_vehicle.serialize())
     return jsonify(new_vehicle.serialize()), 201
 
 #----------------------------favoritos-------------------------------
@@ -275,28 +352,28 @@ def create_vehicle():
 # Obtener todos los favoritos
 @app.route('/favorites', methods=['GET'])
 def get_all_favorites():
-    all_favorites = Favorite.query.all()
-    return jsonify([favorite.serialize() for favorite in all_favorites]), 200
+    # Se envía por páginas en lugar de cargar toda la tabla en memoria
+    expand = parse_expand(request.args.get('expand'), FAVORITE_EXPAND)
+    stream = stream_favorites(expand, FAVORITE_RELATED)
+    return Response(stream_with_context(stream), mimetype='application/json'), 200
 
 # Crear un nuevo favorito
 @app.route('/favorites', methods=['POST'])
-def create_favorite(vehicle_id):
+@idempotent
+def create_favorite():
     user_id = request.json.get('user_id')
-    vehicle = request.json.get('vehicle')
+    vehicle_id = request.json.get('vehicle_id', request.json.get('vehicle'))
     people_id = request.json.get('people_id')
     planet_id = request.json.get('planet_id')
-    username = request.json.get('username')
 
-    new_favorite = Favorite(
+    new_favorite = insert_favorite(
         user_id=user_id,
         vehicle_id=vehicle_id,
         people_id=people_id,
-        planet_id=planet_id,
-        username=username
+        planet_id=planet_id
     )
-    db.session.add(new_favorite)
-    db.session.commit()
-    return jsonify(new_favorite.serialize()), 201
+    publish_event('favorite', 'created', new_favorite, user_id=user_id)
+    return jsonify(new_favorite), 201
 
 # Obtener los favoritos de un usuario específico-------------------
 
@@ -306,49 +383,47 @@ def get_user_favorites(user_id):
     if not user:
         return jsonify({"msg": "User not found"}), 404
 
+    # ?expand=people,planet,vehicle incluye las entidades completas
+    expand = parse_expand(request.args.get('expand'), FAVORITE_EXPAND)
     favorites = Favorite.query.filter_by(user_id=user_id).all()
-    return jsonify([favorite.serialize() for favorite in favorites]), 200
+    return jsonify(serialize_favorites(favorites, expand, FAVORITE_RELATED)), 200
 
 # Añadir un nuevo planeta favorito al usuario actual
 @app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
+@idempotent
 def add_favorite_planet(planet_id):
     user_id = request.json.get('user_id')
-    new_favorite = Favorite(user_id=user_id, planet_id=planet_id)
-    db.session.add(new_favorite)
-    db.session.commit()
-    return jsonify(new_favorite.serialize()), 201
+    new_favorite = insert_favorite(user_id=user_id, planet_id=planet_id)
+    publish_event('favorite', 'created', new_favorite, user_id=user_id)
+    return jsonify(new_favorite), 201
 
 # Añadir un nuevo personaje favorito al usuario actual
 @app.route('/favorite/people/<int:people_id>', methods=['POST'])
+@idempotent
 def add_favorite_people(people_id):
     user_id = request.json.get('user_id')
-    new_favorite = Favorite(user_id=user_id, people_id=people_id)
-    db.session.add(new_favorite)
-    db.session.commit()
-    return jsonify(new_favorite.serialize()), 201
+    new_favorite = insert_favorite(user_id=user_id, people_id=people_id)
+    publish_event('favorite', 'created', new_favorite, user_id=user_id)
+    return jsonify(new_favorite), 201
 
 # Eliminar un planeta favorito por ID
 @app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
 def delete_favorite_planet(planet_id):
-    user_id = request.json.get('user')
-    favorite = Favorite.query.filter_by(user_id=user_id, planet_id=planet_id).first()
-    if not favorite:
+    user_id = request.json.get('user_id', request.json.get('user'))
+    if not delete_favorite(user_id=user_id, planet_id=planet_id):
         return jsonify({"msg": "Favorite not found"}), 404
 
-    db.session.delete(favorite)
-    db.session.commit()
+    publish_event('favorite', 'deleted', {"user_id": user_id, "planet_id": planet_id}, user_id=user_id)
     return jsonify({"msg": "Favorite deleted"}), 200
 
 # Eliminar un personaje favorito por ID
 @app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
 def delete_favorite_people(people_id):
     user_id = request.json.get('user_id')
-    favorite = Favorite.query.filter_by(user_id=user_id, people_id=people_id).first()
-    if not favorite:
+    if not delete_favorite(user_id=user_id, people_id=people_id):
         return jsonify({"msg": "Favorite not found"}), 404
 
-    db.session.delete(favorite)
-    db.session.commit()
+    publish_event('favorite', 'deleted', {"user_id": user_id, "people_id": people_id}, user_id=user_id)
     return jsonify({"msg": "Favorite deleted"}), 200
 
 # Endpoint de ejemplo
@@ -362,4 +437,5 @@ def handle_hello():
 # Esto solo se ejecuta si se ejecuta `$ python src/app.py`
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
+    warm_up(app)
     app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,292 @@
+import io
+import json
+import os
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select
+from models import db, People, Planet, Vehicle
+
+catalogue_cli = AppGroup('catalogue', help='Bulk catalogue tools (people, planets, vehicles).')
+
+MODELS = {
+    'people': People,
+    'planets': Planet,
+    'vehicles': Vehicle,
+}
+
+# Columns that must not be NULL but have no sensible value in a SWAPI dump
+DEFAULTS = {
+    'vehicles': {'model': '', 'manufacturer': ''},
+}
+
+
+def iter_json_array(fh, chunk_size=1 << 16):
+    # Streams the items of a top-level JSON array without loading the whole
+    # document; the buffer only ever holds the item being decoded.
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ValueError('Unexpected end of JSON array')
+            fill()
+            continue
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            fill()
+            continue
+        # A number cut at the chunk boundary decodes fine but short
+        if end == len(buf) and not eof:
+            fill()
+            continue
+        pos = end
+        yield item
+
+
+def iter_records(path, fmt=None):
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'json')
+    with open(path, encoding='utf-8') as fh:
+        if fmt == 'ndjson':
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        first = fh.read(1)
+        while first.isspace():
+            first = fh.read(1)
+        fh.seek(0)
+        if first == '{':
+            # A single SWAPI page: {"count": .., "results": [...]}
+            yield from json.load(fh).get('results', [])
+        else:
+            yield from iter_json_array(fh)
+
+
+def to_row(kind, record, columns):
+    row = []
+    for column in columns:
+        value = record.get(column.name, DEFAULTS.get(kind, {}).get(column.name))
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        if value == '' and column.nullable:
+            value = None
+        length = getattr(column.type, 'length', None)
+        if value is not None and length:
+            value = value[:length]
+        row.append(value)
+    return row
+
+
+def copy_line(row):
+    # COPY's CSV format reads an unquoted empty field as NULL and a quoted one
+    # as '', so every value is quoted and only None is left empty. (csv.writer
+    # leaves '' unquoted, which would break NOT NULL columns such as
+    # vehicle.model.)
+    return ','.join('' if value is None else '"' + value.replace('"', '""') + '"' for value in row) + '\n'
+
+
+def copy_rows(cursor, table, columns, rows):
+    # PostgreSQL (psycopg2): COPY ... FROM STDIN in CSV format into a staging
+    # table, then one INSERT ... SELECT that skips names already present
+    staging = table + '_import'
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS %s ON COMMIT DELETE ROWS AS SELECT %s FROM %s WITH NO DATA'
+                   % (staging, ', '.join(columns), table))
+    buf = io.StringIO()
+    buf.writelines(copy_line(row) for row in rows)
+    buf.seek(0)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (staging, ', '.join(columns)), buf)
+    cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s ON CONFLICT (name) DO NOTHING'
+                   % (table, ', '.join(columns), ', '.join(columns), staging))
+    return cursor.rowcount
+
+
+def multirow_insert(cursor, table, columns, rows, placeholder='%s'):
+    # MySQL: a single INSERT IGNORE ... VALUES (...), (...), ... per batch
+    group = '(' + ', '.join([placeholder] * len(columns)) + ')'
+    sql = 'INSERT IGNORE INTO %s (%s) VALUES %s' % (table, ', '.join(columns), ', '.join([group] * len(rows)))
+    cursor.execute(sql, [value for row in rows for value in row])
+    return cursor.rowcount
+
+
+def executemany_insert(cursor, table, columns, rows, placeholder='?', verb='INSERT'):
+    sql = '%s INTO %s (%s) VALUES (%s)' % (verb, table, ', '.join(columns), ', '.join([placeholder] * len(columns)))
+    cursor.executemany(sql, rows)
+    return cursor.rowcount
+
+
+def existing_names(engine, model, names):
+    with engine.connect() as conn:
+        found = conn.execute(select(model.name).where(model.name.in_(names))).all()
+    return {name for (name,) in found}
+
+
+def unique_names(rows, name_index):
+    # Keeps the first record for a name repeated within the batch
+    seen = set()
+    unique = []
+    for row in rows:
+        if row[name_index] not in seen:
+            seen.add(row[name_index])
+            unique.append(row)
+    return unique
+
+
+class Checkpoint:
+    # "<file>.progress" remembers how many records of the file are committed,
+    # along with the file's size and mtime so a changed file is not resumed
+    def __init__(self, path, kind):
+        self.source = path
+        self.path = path + '.progress'
+        self.kind = kind
+
+    def _stamp(self):
+        stat = os.stat(self.source)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path) as fh:
+            state = json.load(fh)
+        if state.get('kind') != self.kind:
+            raise click.ClickException('%s belongs to a "%s" import' % (self.path, state.get('kind')))
+        if state.get('file') != self._stamp():
+            raise click.ClickException('%s changed since %s was written; rerun with --restart'
+                                       % (self.source, self.path))
+        return state['done']
+
+    def save(self, done):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({'kind': self.kind, 'file': self._stamp(), 'done': done}, fh)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+@catalogue_cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(MODELS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['json', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--resume/--restart', default=True, show_default=True,
+              help='Continue from the last committed batch of a previous run.')
+def import_catalogue(kind, path, fmt, batch_size, resume):
+    """Load a SWAPI-style JSON/NDJSON dump into people, planets or vehicles."""
+    try:
+        loaded, elapsed = import_file(db.engine, kind, path, fmt, batch_size, resume)
+    except db.engine.dialect.dbapi.Error as e:
+        # Committed batches stay in place and the checkpoint points past them
+        raise click.ClickException('Import stopped, the current batch was rolled back: %s' % e)
+    click.echo('Imported %d %s in %.2fs (%.0f rows/s)' % (loaded, kind, elapsed, loaded / elapsed if elapsed else 0))
+
+
+def import_file(engine, kind, path, fmt=None, batch_size=5000, resume=True, echo=click.echo):
+    # Returns (rows loaded, seconds); also used to seed database templates
+    model = MODELS[kind]
+    table = model.__table__
+    columns = [c for c in table.columns if not c.primary_key]
+    names = [c.name for c in columns]
+    name_index = names.index('name')
+    dialect = engine.dialect.name
+
+    checkpoint = Checkpoint(path, kind)
+    if not resume:
+        checkpoint.clear()
+    skip = checkpoint.load()
+    if skip:
+        echo('Resuming after %d records' % skip)
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        # Every path skips names that are already in the table (a re-run, or a
+        # dump overlapping existing rows) and returns how many rows it added
+        if dialect == 'sqlite':
+            # Safe for an offline import: a crash only loses uncommitted batches
+            cursor.execute('PRAGMA synchronous=OFF')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            cursor.execute('PRAGMA cache_size=-65536')
+
+            def insert(rows):
+                # Explicit, so the batch stays one transaction even when the
+                # connection runs in autocommit mode (see sqlite_profile.py)
+                cursor.execute('BEGIN IMMEDIATE')
+                return executemany_insert(cursor, table.name, names, rows, verb='INSERT OR IGNORE')
+        elif dialect == 'postgresql' and hasattr(cursor, 'copy_expert'):
+            def insert(rows):
+                return copy_rows(cursor, table.name, names, rows)
+        elif dialect == 'mysql':
+            def insert(rows):
+                return multirow_insert(cursor, table.name, names, rows)
+        else:
+            style = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+
+            def insert(rows):
+                seen = existing_names(engine, model, [row[name_index] for row in rows])
+                rows = unique_names([row for row in rows if row[name_index] not in seen], name_index)
+                return executemany_insert(cursor, table.name, names, rows, style) if rows else 0
+
+        done = skip
+        loaded = 0
+        batch = []
+        start = time.perf_counter()
+
+        def flush():
+            # A batch the previous run committed right before dying, without
+            # getting to write the checkpoint, is skipped as existing names
+            nonlocal loaded, batch
+            rows = [to_row(kind, record, columns) for record in batch if record.get('name')]
+            if rows:
+                loaded += insert(rows)
+            conn.commit()
+            checkpoint.save(done)
+            batch = []
+            elapsed = time.perf_counter() - start
+            echo('%d rows loaded (%.0f rows/s)' % (loaded, loaded / elapsed if elapsed else 0))
+
+        for i, record in enumerate(iter_records(path, fmt)):
+            if i < skip:
+                continue
+            batch.append(record)
+            done = i + 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    checkpoint.clear()
+    return loaded, time.perf_counter() - start
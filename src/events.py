@@ -0,0 +1,370 @@
+import fcntl
+import json
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+# Sent when a Last-Event-ID can no longer be replayed (too old, another
+# process, or the subscriber fell behind): the client should refetch.
+RESET = {'id': None, 'event': 'reset', 'data': {}}
+
+
+class LocalTransport:
+    """Delivers events within this process only (dev server, single worker)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._deliver = None
+
+    def start(self, deliver, reset):
+        self._deliver = deliver
+
+    def listen(self):
+        pass
+
+    def publish(self, event):
+        with self._lock:
+            self._last_id += 1
+            event['id'] = self._last_id
+            self._deliver(event)
+
+    def replay(self, last_id):
+        # The broker's ring buffer is the only history
+        return None
+
+    def last_id(self):
+        return self._last_id
+
+
+class FileTransport:
+    """Shares events between the workers of a host through an NDJSON log.
+
+    Writers append under flock and use the byte offset of the line as the
+    event id, so ids are unique and increasing across workers. Every worker
+    tails the log and feeds its own broker; replay reads the log from the
+    client's Last-Event-ID. The log is not rotated here: use logrotate with
+    copytruncate. Ids then start over from 0, so when a tailer notices the
+    truncation every open stream receives a reset and starts afresh.
+    """
+
+    def __init__(self, path, poll_interval=0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._deliver = None
+        self._reset = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self, deliver, reset):
+        self._deliver = deliver
+        self._reset = reset
+
+    def listen(self):
+        self._ensure_tailer()
+
+    def _ensure_tailer(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                open(self.path, 'a').close()
+                offset = os.path.getsize(self.path)
+                self._thread = threading.Thread(target=self._tail, args=(offset,), name='events-tail', daemon=True)
+                self._thread.start()
+
+    def _tail(self, offset):
+        with open(self.path, 'rb') as fh:
+            fh.seek(offset)
+            while True:
+                line = fh.readline()
+                if not line.endswith(b'\n'):
+                    # Nothing new, or a line still being written
+                    fh.seek(offset)
+                    if os.path.getsize(self.path) < offset:
+                        offset = self._truncated(fh)
+                    time.sleep(self.poll_interval)
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    event = None
+                if event is None or event.get('id') != offset:
+                    if offset:
+                        # Truncated and refilled past our offset between
+                        # two polls: the id (its own byte offset) gives it away
+                        offset = self._truncated(fh)
+                    else:
+                        # A damaged line cannot be a truncation: skip it
+                        offset = fh.tell()
+                    continue
+                offset = fh.tell()
+                self._deliver(event)
+
+    def _truncated(self, fh):
+        # The log was truncated (copytruncate) and ids start over from 0
+        self._reset()
+        fh.seek(0)
+        return 0
+
+    def publish(self, event):
+        self._ensure_tailer()
+        with open(self.path, 'ab') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                fh.seek(0, os.SEEK_END)
+                event['id'] = fh.tell()
+                fh.write(json.dumps(event).encode('utf-8') + b'\n')
+                fh.flush()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def replay(self, last_id):
+        self._ensure_tailer()
+        try:
+            with open(self.path, 'rb') as fh:
+                fh.seek(last_id)
+                line = fh.readline()
+                if not line.endswith(b'\n') or json.loads(line).get('id') != last_id:
+                    return None
+                events = []
+                for line in fh:
+                    if line.endswith(b'\n'):
+                        events.append(json.loads(line))
+                return events
+        except (OSError, ValueError):
+            return None
+
+    def last_id(self):
+        return None
+
+
+class Subscriber:
+    def __init__(self, types, user_id, size):
+        self.types = types
+        self.user_id = user_id
+        self.queue = deque()
+        self.size = size
+        self.overflowed = False
+        self.ready = threading.Condition()
+
+    def wants(self, event):
+        if self.types and event['resource'] not in self.types:
+            return False
+        # A user filter hides other users' events; catalogue events have no user
+        if self.user_id is not None and event.get('user_id') not in (None, self.user_id):
+            return False
+        return True
+
+    def reset(self):
+        # Replaces whatever is queued: the client refetches anyway
+        with self.ready:
+            self.queue.clear()
+            self.queue.append(RESET)
+            self.ready.notify()
+
+    def push(self, event):
+        with self.ready:
+            if len(self.queue) >= self.size:
+                # Too slow: disconnect it rather than silently drop events,
+                # the client reconnects with its Last-Event-ID
+                self.overflowed = True
+            else:
+                self.queue.append(event)
+            self.ready.notify()
+
+    def pop_all(self, timeout):
+        with self.ready:
+            if not self.queue and not self.overflowed:
+                self.ready.wait(timeout)
+            events = list(self.queue)
+            self.queue.clear()
+            return events
+
+
+class Broker:
+    """Fans events out to the SSE subscribers of this process."""
+
+    def __init__(self, transport, buffer_size=256, history=1000, max_subscribers=4):
+        self.transport = transport
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        transport.start(self._deliver, self._reset)
+
+    def _deliver(self, event):
+        with self._lock:
+            self.history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.wants(event):
+                subscriber.push(event)
+
+    def _reset(self):
+        # Ids restart (log truncated): history and every open stream's
+        # high-water mark refer to the old ids
+        with self._lock:
+            self.history.clear()
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.reset()
+
+    def publish(self, resource, action, data, user_id=None):
+        self.transport.publish({'resource': resource, 'action': action, 'user_id': user_id, 'data': data})
+
+    def subscribe(self, types, user_id):
+        # None when this process already streams to max_subscribers clients
+        self.transport.listen()
+        subscriber = Subscriber(types, user_id, self.buffer_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def replay(self, last_id):
+        # Events after `last_id`, or None when they cannot be reconstructed
+        with self._lock:
+            history = list(self.history)
+        ids = [event['id'] for event in history]
+        if last_id in ids:
+            return history[ids.index(last_id) + 1:]
+        if last_id == self.transport.last_id():
+            return []
+        return self.transport.replay(last_id)
+
+
+def _is_id(value):
+    # isdigit() alone also accepts characters such as '²' that int() rejects
+    return value.isascii() and value.isdigit()
+
+
+def _client_gone(sock):
+    # SSE clients send nothing after the request, so a readable socket that
+    # yields no data is an EOF
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+def format_event(event):
+    if event is RESET:
+        return 'event: reset\ndata: {}\n\n'
+    name = '%s.%s' % (event['resource'], event['action'])
+    return 'id: %s\nevent: %s\ndata: %s\n\n' % (event['id'], name, json.dumps(event['data']))
+
+
+def publish_event(resource, action, data, user_id=None):
+    broker = current_app.extensions.get('events')
+    if broker is not None:
+        broker.publish(resource, action, data, user_id)
+
+
+def setup_events(app):
+    app.config.setdefault('EVENTS_TRANSPORT', os.getenv('EVENTS_TRANSPORT', 'local'))
+    app.config.setdefault('EVENTS_LOG', os.getenv('EVENTS_LOG', '/tmp/starwars-events.ndjson'))
+    app.config.setdefault('EVENTS_BUFFER', int(os.getenv('EVENTS_BUFFER', 256)))
+    app.config.setdefault('EVENTS_HISTORY', int(os.getenv('EVENTS_HISTORY', 1000)))
+    app.config.setdefault('EVENTS_KEEPALIVE_SECONDS', float(os.getenv('EVENTS_KEEPALIVE_SECONDS', 15)))
+    # Each open stream holds a worker thread for as long as it lasts; keep
+    # this well below gunicorn's --threads so the API keeps answering
+    app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', int(os.getenv('EVENTS_MAX_SUBSCRIBERS', 4)))
+    if app.config['EVENTS_TRANSPORT'] == 'off':
+        return
+    if app.config['EVENTS_TRANSPORT'] == 'file':
+        transport = FileTransport(app.config['EVENTS_LOG'])
+    else:
+        transport = LocalTransport()
+    broker = Broker(transport, app.config['EVENTS_BUFFER'], app.config['EVENTS_HISTORY'],
+                    app.config['EVENTS_MAX_SUBSCRIBERS'])
+    app.extensions['events'] = broker
+    keepalive = app.config['EVENTS_KEEPALIVE_SECONDS']
+
+    # Each open stream holds a worker thread: gunicorn runs with
+    # --worker-class gthread (see Procfile), never plain sync workers.
+    @app.route('/events', methods=['GET'])
+    def stream_events():
+        types = {t.strip() for t in request.args.get('types', '').split(',') if t.strip()}
+        user_id = request.args.get('user_id')
+        if user_id is not None and not _is_id(user_id):
+            return jsonify({"msg": "Invalid user id: " + user_id}), 400
+        user_id = int(user_id) if user_id is not None else None
+        last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        if last_id is not None and not _is_id(last_id):
+            return jsonify({"msg": "Invalid Last-Event-ID"}), 400
+
+        subscriber = broker.subscribe(types, user_id)
+        if subscriber is None:
+            response = jsonify({"msg": "Too many event streams open, try again later"})
+            response.status_code = 503
+            response.headers['Retry-After'] = '5'
+            return response
+        backlog = []
+        if last_id is not None:
+            replayed = broker.replay(int(last_id))
+            if replayed is None:
+                backlog = [RESET]
+            else:
+                backlog = [event for event in replayed if subscriber.wants(event)]
+
+        # gunicorn exposes the client socket; a stream whose client went away
+        # frees its subscriber slot within a second instead of only failing
+        # on the second write after the disconnect
+        sock = request.environ.get('gunicorn.socket')
+
+        def generate():
+            sent = int(last_id) if last_id is not None else -1
+            try:
+                yield 'retry: 3000\n\n'
+                for event in backlog:
+                    if event is RESET:
+                        # The client's id means nothing here (e.g. another
+                        # worker or a restart): deliver everything from now on
+                        yield format_event(event)
+                        sent = -1
+                    elif event['id'] > sent:
+                        yield format_event(event)
+                        sent = event['id']
+                idle = 0.0
+                while True:
+                    events = subscriber.pop_all(min(keepalive, 1.0))
+                    if not events and not subscriber.overflowed:
+                        if _client_gone(sock):
+                            return
+                        idle += min(keepalive, 1.0)
+                        if idle >= keepalive:
+                            yield ': keepalive\n\n'
+                            idle = 0.0
+                        continue
+                    idle = 0.0
+                    for event in events:
+                        if event is RESET:
+                            yield format_event(event)
+                            sent = -1
+                        # Skip what the replay already covered
+                        elif event['id'] > sent:
+                            yield format_event(event)
+                            sent = event['id']
+                    if subscriber.overflowed:
+                        return
+            finally:
+                broker.unsubscribe(subscriber)
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
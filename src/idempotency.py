@@ -0,0 +1,268 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, jsonify, make_response, request
+
+NEW, DONE, BUSY, MISMATCH = 'new', 'done', 'busy', 'mismatch'
+
+
+class MemoryStore:
+    """Bounded, TTL-evicted store for one process.
+
+    `begin` reserves a key for the first request; duplicates that arrive
+    while it runs get BUSY and block in `wait` until it completes. Completed
+    records are kept in completion order, which is also expiry order since
+    the TTL is fixed, so eviction only ever pops from the front.
+    """
+
+    def __init__(self, max_keys=10000, ttl=86400):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._entries = OrderedDict()
+
+    def _evict(self, now):
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry['expires'] >= now and len(self._entries) <= self.max_keys:
+                break
+            self._entries.popitem(last=False)
+
+    def begin(self, key, fingerprint):
+        with self._lock:
+            now = time.time()
+            self._evict(now)
+            entry = self._pending.get(key)
+            if entry is not None:
+                return (BUSY if entry['fingerprint'] == fingerprint else MISMATCH), None
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] >= now:
+                if entry['fingerprint'] != fingerprint:
+                    return MISMATCH, None
+                return DONE, entry['record']
+            self._entries.pop(key, None)
+            self._pending[key] = {'fingerprint': fingerprint, 'record': None, 'done': threading.Event()}
+            return NEW, None
+
+    def wait(self, key, timeout):
+        # None when it timed out or the first request gave up (see abandon)
+        with self._lock:
+            entry = self._pending.get(key) or self._entries.get(key)
+        if entry is None:
+            return None
+        entry['done'].wait(timeout)
+        return entry['record']
+
+    def complete(self, key, record, fingerprint):
+        with self._lock:
+            entry = self._pending.pop(key)
+            entry['record'] = record
+            entry['expires'] = time.time() + self.ttl
+            self._entries[key] = entry
+            self._evict(time.time())
+            entry['done'].set()
+
+    def abandon(self, key):
+        with self._lock:
+            entry = self._pending.pop(key, None)
+        if entry is not None:
+            entry['done'].set()
+
+
+class FileStore:
+    """Store shared by every worker on the host: one JSON file per key.
+
+    The key is reserved by creating its file with O_EXCL, so exactly one
+    worker runs the request; the others poll until the record is written.
+    A reservation left behind by a dead worker is taken over after
+    `lock_timeout` seconds, and an expired record after `ttl`; takeovers
+    are rare, so they are serialized on a single flock for the directory.
+    """
+
+    def __init__(self, directory, max_keys=10000, ttl=86400, lock_timeout=30):
+        self.directory = directory
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._takeover_lock = os.path.join(directory, '.takeover.lock')
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _read(self, path):
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            # ValueError: the reservation is being written right now
+            return None
+
+    def _write(self, path, entry):
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as fh:
+            json.dump(entry, fh)
+        os.replace(tmp, path)
+
+    def _prune(self):
+        self._writes += 1
+        if self._writes % 100:
+            return
+        now = time.time()
+        entries = sorted((entry for entry in os.scandir(self.directory) if not entry.name.startswith('.')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for i, entry in enumerate(entries):
+            expired = entry.stat().st_mtime + self.ttl < now
+            if expired or len(entries) - i > self.max_keys:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def begin(self, key, fingerprint):
+        path = self._path(key)
+        reservation = {'fingerprint': fingerprint, 'record': None, 'started': time.time()}
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            entry = self._read(path)
+            if entry is None:
+                return BUSY, None
+            if self._replaceable(path, entry):
+                with open(self._takeover_lock, 'a') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    try:
+                        # Look again under the lock: another worker may have
+                        # taken it over (or the owner finished) meanwhile
+                        entry = self._read(path)
+                        if entry is None or self._replaceable(path, entry):
+                            self._write(path, reservation)
+                            return NEW, None
+                    finally:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+            if entry['fingerprint'] != fingerprint:
+                return MISMATCH, None
+            if entry['record'] is None:
+                return BUSY, None
+            return DONE, entry['record']
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(reservation, fh)
+        self._prune()
+        return NEW, None
+
+    def _replaceable(self, path, entry):
+        # A reservation whose worker has presumably died, or an expired record
+        now = time.time()
+        if entry['record'] is None:
+            return entry['started'] + self.lock_timeout < now
+        try:
+            return os.path.getmtime(path) + self.ttl < now
+        except FileNotFoundError:
+            return True
+
+    def wait(self, key, timeout):
+        path = self._path(key)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            entry = self._read(path)
+            if entry is not None and entry['record'] is not None:
+                return entry['record']
+            if entry is None and not os.path.exists(path):
+                return None
+            time.sleep(0.01)
+        return None
+
+    def complete(self, key, record, fingerprint):
+        # The full entry is written: the reservation may already be gone
+        # (pruned), and begin() needs the fingerprint to compare against
+        self._write(self._path(key), {'fingerprint': fingerprint, 'record': record, 'started': time.time()})
+
+    def abandon(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def setup_idempotency(app):
+    app.config.setdefault('IDEMPOTENCY_BACKEND', os.getenv('IDEMPOTENCY_BACKEND', 'memory'))
+    app.config.setdefault('IDEMPOTENCY_DIR', os.getenv('IDEMPOTENCY_DIR', '/tmp/starwars-idempotency'))
+    app.config.setdefault('IDEMPOTENCY_TTL', int(os.getenv('IDEMPOTENCY_TTL', 86400)))
+    app.config.setdefault('IDEMPOTENCY_MAX_KEYS', int(os.getenv('IDEMPOTENCY_MAX_KEYS', 10000)))
+    app.config.setdefault('IDEMPOTENCY_WAIT_SECONDS', float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 10)))
+    backend = app.config['IDEMPOTENCY_BACKEND']
+    if backend == 'off':
+        return
+    if backend == 'file':
+        store = FileStore(app.config['IDEMPOTENCY_DIR'], app.config['IDEMPOTENCY_MAX_KEYS'],
+                          app.config['IDEMPOTENCY_TTL'])
+    else:
+        store = MemoryStore(app.config['IDEMPOTENCY_MAX_KEYS'], app.config['IDEMPOTENCY_TTL'])
+    app.extensions['idempotency'] = store
+
+
+def _replay(record):
+    response = current_app.response_class(record['body'], status=record['status'], mimetype=record['mimetype'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Replays the stored response for a repeated Idempotency-Key header.
+
+    Keys are scoped to method and path, and a key reused with a different
+    body is rejected with 422. 5xx responses are not stored, so the client
+    can retry them.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        store = current_app.extensions.get('idempotency')
+        if not key or store is None:
+            return view(*args, **kwargs)
+
+        scoped = '%s %s %s' % (request.method, request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        state, record = store.begin(scoped, fingerprint)
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+        while state == BUSY:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                response = jsonify({"msg": "A request with this Idempotency-Key is still in progress"})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+            record = store.wait(scoped, remaining)
+            if record is not None:
+                state = DONE
+            else:
+                # Timed out, or the first request failed and released the key:
+                # in the latter case this request takes it over
+                state, record = store.begin(scoped, fingerprint)
+        if state == MISMATCH:
+            return jsonify({"msg": "Idempotency-Key was already used with a different request body"}), 422
+        if record is not None:
+            return _replay(record)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            store.abandon(scoped)
+            raise
+        if response.status_code >= 500:
+            store.abandon(scoped)
+        else:
+            store.complete(scoped, {
+                'status': response.status_code,
+                'mimetype': response.mimetype,
+                'body': response.get_data(as_text=True),
+            }, fingerprint)
+        return response
+    return wrapper
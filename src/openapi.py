@@ -0,0 +1,136 @@
+import re
+from sqlalchemy import Boolean, Integer, String
+from models import User, People, Planet, Vehicle, Favorite
+
+# First path segment -> model the route returns
+RESOURCES = {
+    'people': People,
+    'planets': Planet,
+    'vehicles': Vehicle,
+    'users': User,
+    'favorites': Favorite,
+    'favorite': Favorite,
+}
+
+# Columns that are accepted on input but never serialized
+WRITE_ONLY = {('user', 'password')}
+
+# Keys Favorite.serialize() adds on top of its columns
+EXTRA_PROPERTIES = {
+    'favorite': {name: {'type': 'string', 'nullable': True}
+                 for name in ('user_name', 'people_name', 'planet_name', 'vehicle_name')},
+}
+
+ID_LIST = {'name': 'ids', 'in': 'query', 'required': False, 'description': 'Comma separated ids, e.g. 1,2,3',
+           'schema': {'type': 'string'}}
+FOR_USER = {'name': 'for_user', 'in': 'query', 'required': False, 'description': 'Adds is_favorite for this user',
+            'schema': {'type': 'integer'}}
+EXPAND = {'name': 'expand', 'in': 'query', 'required': False, 'description': 'Any of people,planet,vehicle',
+          'schema': {'type': 'string'}}
+
+QUERY_PARAMETERS = {
+    'get_all_people': [ID_LIST, FOR_USER],
+    'get_all_planets': [ID_LIST, FOR_USER],
+    'get_all_vehicles': [ID_LIST, FOR_USER],
+    'get_all_favorites': [EXPAND],
+    'get_user_favorites': [EXPAND],
+}
+
+MESSAGE = {'type': 'object', 'properties': {'msg': {'type': 'string'}}}
+
+# Endpoints that do not answer with JSON models
+RAW_RESPONSES = {
+    'sitemap': {'text/html': {'schema': {'type': 'string'}}},
+    'openapi_spec': {'application/json': {'schema': {'type': 'object'}}},
+}
+
+ARGUMENT = re.compile(r'<(?:(\w+)(?:\([^)]*\))?:)?(\w+)>')
+
+
+def column_schema(column):
+    if isinstance(column.type, Integer):
+        schema = {'type': 'integer'}
+    elif isinstance(column.type, Boolean):
+        schema = {'type': 'boolean'}
+    elif isinstance(column.type, String):
+        schema = {'type': 'string'}
+        if column.type.length:
+            schema['maxLength'] = column.type.length
+    else:
+        schema = {'type': 'string'}
+    if column.nullable:
+        schema['nullable'] = True
+    if column.primary_key:
+        schema['readOnly'] = True
+    if (column.table.name, column.name) in WRITE_ONLY:
+        schema['writeOnly'] = True
+    return schema
+
+
+def model_schema(model):
+    table = model.__table__
+    properties = {column.name: column_schema(column) for column in table.columns}
+    properties.update(EXTRA_PROPERTIES.get(table.name, {}))
+    required = [column.name for column in table.columns
+                if not column.nullable and not column.primary_key and column.default is None]
+    schema = {'type': 'object', 'properties': properties}
+    if required:
+        schema['required'] = required
+    return schema
+
+
+def operation(rule, method, model):
+    ref = {'$ref': '#/components/schemas/%s' % model.__name__} if model else MESSAGE
+    has_id = bool(rule.arguments)
+    op = {'operationId': rule.endpoint, 'responses': {}}
+    if model:
+        op['tags'] = [model.__name__]
+
+    parameters = []
+    for converter, name in ARGUMENT.findall(rule.rule):
+        parameters.append({'name': name, 'in': 'path', 'required': True,
+                           'schema': {'type': 'integer' if converter == 'int' else 'string'}})
+    parameters.extend(QUERY_PARAMETERS.get(rule.endpoint, []))
+    if parameters:
+        op['parameters'] = parameters
+
+    if method in ('POST', 'PUT') and model:
+        op['requestBody'] = {'content': {'application/json': {'schema': ref}}}
+
+    if rule.endpoint in RAW_RESPONSES:
+        op['responses']['200'] = {'description': 'OK', 'content': RAW_RESPONSES[rule.endpoint]}
+    elif method == 'DELETE':
+        op['responses']['200'] = {'description': 'Deleted', 'content': {'application/json': {'schema': MESSAGE}}}
+    elif method == 'GET' and model and (not has_id or rule.endpoint == 'get_user_favorites'):
+        op['responses']['200'] = {'description': 'OK', 'content': {
+            'application/json': {'schema': {'type': 'array', 'items': ref}}}}
+    else:
+        status = '201' if method == 'POST' else '200'
+        op['responses'][status] = {'description': 'OK', 'content': {'application/json': {'schema': ref}}}
+    if has_id:
+        op['responses']['404'] = {'description': 'Not found',
+                                  'content': {'application/json': {'schema': MESSAGE}}}
+    return op
+
+
+def build_openapi(app, title='Star Wars API', version='1.0.0'):
+    paths = {}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static' or rule.rule.startswith('/admin'):
+            continue
+        segments = [part for part in rule.rule.strip('/').split('/') if not part.startswith('<')]
+        if 'favorites' in segments or 'favorite' in segments:
+            model = Favorite
+        else:
+            model = RESOURCES.get(segments[0] if segments else '')
+        path = ARGUMENT.sub(r'{\2}', rule.rule)
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            paths.setdefault(path, {})[method.lower()] = operation(rule, method, model)
+
+    return {
+        'openapi': '3.0.3',
+        'info': {'title': title, 'version': version},
+        'paths': dict(sorted(paths.items())),
+        'components': {'schemas': {model.__name__: model_schema(model)
+                                   for model in sorted(set(RESOURCES.values()), key=lambda m: m.__name__)}},
+    }
@@ -0,0 +1,198 @@
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from flask import g, jsonify, request
+from sqlalchemy import event
+from models import db
+
+# Profiles running right now, by thread id; read by the SQL event hooks
+_active = {}
+
+
+class RequestProfile:
+    """Sampling profiler for one request thread plus the SQL it issues.
+
+    A helper thread snapshots the request thread's stack every `interval`
+    seconds, which is enough for flamegraphs and cheap enough to leave on
+    for a small percentage of traffic.
+    """
+
+    def __init__(self, interval):
+        self.id = uuid.uuid4().hex
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = {}
+        self.queries = []
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        _active[self.thread_id] = self
+        self._sampler.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        _active.pop(self.thread_id, None)
+        self._stop.set()
+        self._sampler.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = tuple(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def folded(self):
+        # Brendan Gregg's collapsed format, for flamegraph.pl / speedscope
+        lines = [';'.join(stack) + ' %d' % count for stack, count in self.stacks.items()]
+        for query in self.queries:
+            lines.append('SQL;%s %d' % (query['statement'].replace(';', ' ').replace('\n', ' '),
+                                        max(1, int(query['ms'] / (self.interval * 1000)))))
+        return '\n'.join(lines) + '\n'
+
+    def call_tree(self):
+        root = {'name': 'root', 'samples': 0, 'children': {}}
+        for stack, count in self.stacks.items():
+            node = root
+            node['samples'] += count
+            for name in stack:
+                node = node['children'].setdefault(name, {'name': name, 'samples': 0, 'children': {}})
+                node['samples'] += count
+
+        def to_list(node):
+            children = sorted(node['children'].values(), key=lambda n: -n['samples'])
+            return {'name': node['name'], 'samples': node['samples'], 'children': [to_list(c) for c in children]}
+        return to_list(root)
+
+    def report(self, method, path, status):
+        return {
+            'id': self.id,
+            'method': method,
+            'path': path,
+            'status': status,
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+            'interval_ms': self.interval * 1000,
+            'sql_ms': round(sum(q['ms'] for q in self.queries), 3),
+            'queries': self.queries,
+            'call_tree': self.call_tree(),
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if threading.get_ident() in _active:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active.get(threading.get_ident())
+    started = conn.info.get('profile_started')
+    if profile is None or not started:
+        return
+    profile.queries.append({
+        'statement': statement,
+        'ms': round((time.perf_counter() - started.pop()) * 1000, 3),
+    })
+
+
+def setup_profiling(app):
+    app.config.setdefault('PROFILE_TOKEN', os.getenv('PROFILE_TOKEN'))
+    app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.getenv('PROFILE_SAMPLE_RATE', 0)))
+    app.config.setdefault('PROFILE_INTERVAL_MS', float(os.getenv('PROFILE_INTERVAL_MS', 5)))
+    app.config.setdefault('PROFILE_DIR', os.getenv('PROFILE_DIR', '/tmp/starwars-profiles'))
+    app.config.setdefault('PROFILE_KEEP', int(os.getenv('PROFILE_KEEP', 200)))
+    token = app.config['PROFILE_TOKEN']
+    # PROFILE_SAMPLE_RATE is a percentage of requests (0.5 = one in 200)
+    rate = app.config['PROFILE_SAMPLE_RATE'] / 100.0
+    if not token and not rate:
+        # Nothing is hooked in at all when profiling is off
+        return
+
+    interval = app.config['PROFILE_INTERVAL_MS'] / 1000.0
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def authorized():
+        supplied = request.headers.get('X-Profile') or request.args.get('__profile')
+        # compare_digest rejects non-ASCII str, so compare bytes
+        return bool(token and supplied) and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+    def store(profile, report):
+        with open(os.path.join(directory, profile.id + '.json'), 'w') as fh:
+            json.dump(report, fh)
+        with open(os.path.join(directory, profile.id + '.folded'), 'w') as fh:
+            fh.write(profile.folded())
+        reports = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in reports[:-app.config['PROFILE_KEEP']]:
+            for suffix in ('.json', '.folded'):
+                try:
+                    os.remove(entry.path[:-len('.json')] + suffix)
+                except FileNotFoundError:
+                    pass
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint == 'get_profile':
+            return
+        if authorized() or (rate and random.random() < rate):
+            g.profile = RequestProfile(interval)
+            g.profile.start()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        report = (request.method, request.full_path, response.status_code)
+
+        def finish():
+            profile.stop()
+            store(profile, profile.report(*report))
+        response.headers['X-Profile-Id'] = profile.id
+        if response.is_streamed:
+            # The body (and its SQL) runs after this hook, on the same thread
+            response.call_on_close(finish)
+        else:
+            finish()
+        return response
+
+    @app.teardown_request
+    def abort_profile(exc):
+        # after_request does not run when the view raised
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.stop()
+
+    if not token:
+        return
+
+    @app.route('/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        if not authorized():
+            return jsonify({"msg": "Not authorized"}), 403
+        if not re.fullmatch(r'[0-9a-f]{32}', profile_id):
+            return jsonify({"msg": "Profile not found"}), 404
+        fmt = 'folded' if request.args.get('format') == 'folded' else 'json'
+        path = os.path.join(directory, profile_id + '.' + fmt)
+        if not os.path.exists(path):
+            return jsonify({"msg": "Profile not found"}), 404
+        with open(path) as fh:
+            body = fh.read()
+        return body, 200, {'Content-Type': 'application/json' if fmt == 'json' else 'text/plain'}
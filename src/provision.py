@@ -0,0 +1,171 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+import click
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from models import db
+from catalogue_import import MODELS, import_file
+
+template_cli = AppGroup('template', help='Pre-built database templates for tests and benchmarks.')
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'migrations')
+DEFAULT_TEMPLATE_URL = 'sqlite:////tmp/starwars-template.db'
+
+
+def template_url():
+    return os.getenv('DB_TEMPLATE_URL', DEFAULT_TEMPLATE_URL)
+
+
+def alembic_head():
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return ScriptDirectory.from_config(config)
+
+
+def _admin_engine(url):
+    # Connection to the maintenance database, for CREATE/DROP DATABASE
+    return create_engine(make_url(url).set(database='postgres'), isolation_level='AUTOCOMMIT')
+
+
+def build_template(url, seed_files=(), echo=click.echo):
+    """Create the schema at the Alembic head in `url` and load the seed files.
+
+    SQLite templates are created from the models and stamped with the head
+    revision, because the existing migrations use unnamed constraints that
+    Alembic cannot replay on SQLite; `verify_template` checks the result
+    against both. PostgreSQL templates run the real migrations.
+    """
+    url = make_url(url)
+    start = time.perf_counter()
+    if url.get_backend_name() == 'sqlite':
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(url.database + suffix):
+                os.remove(url.database + suffix)
+        engine = create_engine(url)
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            MigrationContext.configure(conn).stamp(alembic_head(), 'head')
+    elif url.get_backend_name() == 'postgresql':
+        admin = _admin_engine(url)
+        with admin.connect() as conn:
+            conn.execute(text('DROP DATABASE IF EXISTS "%s"' % url.database))
+            conn.execute(text('CREATE DATABASE "%s"' % url.database))
+        admin.dispose()
+        # env.py reads the target from the app, so run the migrations in a
+        # child process pointed at the template database
+        env = dict(os.environ, DATABASE_URL=url.render_as_string(hide_password=False))
+        if subprocess.run([sys.executable, '-m', 'flask', 'db', 'upgrade'], env=env).returncode != 0:
+            raise click.ClickException('flask db upgrade failed for the template database')
+        engine = create_engine(url)
+    else:
+        raise click.ClickException('Templates are supported for SQLite and PostgreSQL only')
+
+    for kind, path in seed_files:
+        loaded, _ = import_file(engine, kind, path, resume=False, echo=lambda msg: None)
+        echo('Seeded %d %s from %s' % (loaded, kind, path))
+
+    if url.get_backend_name() == 'sqlite':
+        # Fold the WAL back into a single, compact file that is cheap to copy
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.exec_driver_sql('PRAGMA journal_mode=DELETE')
+            conn.exec_driver_sql('VACUUM')
+    engine.dispose()
+    echo('Template built in %.2fs' % (time.perf_counter() - start))
+
+
+def verify_template(url):
+    # Returns a list of problems; empty means the template is at the Alembic
+    # head and its tables match the models.
+    problems = []
+    head = alembic_head().get_current_head()
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            context = MigrationContext.configure(conn)
+            current = context.get_current_revision()
+            if current != head:
+                problems.append('template is at revision %s, head is %s' % (current, head))
+            for diff in compare_metadata(context, db.metadata):
+                problems.append('schema differs from models: %r' % (diff,))
+    finally:
+        engine.dispose()
+    return problems
+
+
+def clone_template(url, target):
+    """Copy the template into `target` (a file path for SQLite, a database
+    name for PostgreSQL) and return the URL of the copy."""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        tmp = target + '.tmp'
+        shutil.copyfile(url.database, tmp)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(tmp, target)
+        return url.set(database=os.path.abspath(target)).render_as_string(hide_password=False)
+
+    admin = _admin_engine(url)
+    try:
+        with admin.connect() as conn:
+            conn.execute(text('DROP DATABASE IF EXISTS "%s"' % target))
+            conn.execute(text('CREATE DATABASE "%s" TEMPLATE "%s"' % (target, url.database)))
+    finally:
+        admin.dispose()
+    return url.set(database=target).render_as_string(hide_password=False)
+
+
+def parse_seed(value):
+    # "people=dump.json" or just "people.json" (kind taken from the file name)
+    if '=' in value:
+        kind, path = value.split('=', 1)
+    else:
+        path = value
+        kind = os.path.basename(value).split('.')[0]
+    if kind not in MODELS:
+        raise click.BadParameter('Unknown kind "%s" (use one of %s)' % (kind, ', '.join(sorted(MODELS))))
+    return kind, path
+
+
+@template_cli.command('build')
+@click.option('--url', default=template_url, show_default='$DB_TEMPLATE_URL or ' + DEFAULT_TEMPLATE_URL)
+@click.option('--seed', multiple=True, help='kind=file.json to load into the template, repeatable.')
+def build_command(url, seed):
+    """Build the schema once (plus optional seed data) as a template."""
+    build_template(url, [parse_seed(value) for value in seed])
+    problems = verify_template(url)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise click.ClickException('Template does not match the Alembic head')
+
+
+@template_cli.command('verify')
+@click.option('--url', default=template_url, show_default='$DB_TEMPLATE_URL or ' + DEFAULT_TEMPLATE_URL)
+def verify_command(url):
+    """Check that the template matches the Alembic head and the models."""
+    problems = verify_template(url)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise click.ClickException('Template is out of date, run `flask template build`')
+    click.echo('Template is at head %s' % alembic_head().get_current_head())
+
+
+@template_cli.command('clone')
+@click.argument('target')
+@click.option('--url', default=template_url, show_default='$DB_TEMPLATE_URL or ' + DEFAULT_TEMPLATE_URL)
+def clone_command(target, url):
+    """Clone the template into TARGET (file path or database name)."""
+    start = time.perf_counter()
+    clone_url = clone_template(url, target)
+    click.echo('%s (%.1f ms)' % (clone_url, (time.perf_counter() - start) * 1000))
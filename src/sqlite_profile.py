@@ -0,0 +1,52 @@
+import os
+from flask import has_request_context, request
+from sqlalchemy import event
+from models import db
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def setup_sqlite_profile(app):
+    # Only applies when the app runs on SQLite (e.g. the /tmp/test.db
+    # fallback). SQLITE_PROFILE=off keeps the driver defaults.
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return
+    app.config.setdefault('SQLITE_PROFILE', os.getenv('SQLITE_PROFILE', 'tuned'))
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT_MS', int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)))
+    app.config.setdefault('SQLITE_MMAP_SIZE', int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)))
+    app.config.setdefault('SQLITE_CACHE_SIZE_KB', int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024)))
+    if app.config['SQLITE_PROFILE'] != 'tuned':
+        return
+
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA busy_timeout=%d' % app.config['SQLITE_BUSY_TIMEOUT_MS'],
+        'PRAGMA mmap_size=%d' % app.config['SQLITE_MMAP_SIZE'],
+        # Negative values are KiB instead of pages
+        'PRAGMA cache_size=-%d' % app.config['SQLITE_CACHE_SIZE_KB'],
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself (see on_begin) instead of pysqlite
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        # Writers take the write lock up front, so concurrent writers from
+        # other gunicorn workers queue on busy_timeout instead of failing
+        # with "database is locked" when a deferred transaction tries to
+        # upgrade. Reads run in autocommit (like pysqlite's default) so they
+        # never hold a lock or pay for an extra BEGIN/ROLLBACK round trip.
+        # Work outside a request (CLI, group commit) is treated as a write.
+        if not has_request_context() or request.method in WRITE_METHODS:
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
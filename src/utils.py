@@ -1,4 +1,6 @@
-from flask import jsonify, url_for
+import hashlib
+from flask import jsonify, url_for, g, current_app, request
+from models import db, Favorite
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +17,106 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def parse_id_list(value, max_ids=100):
+    # Turns "1,2,3" into [1, 2, 3], keeping the order and dropping duplicates
+    ids = []
+    for chunk in value.split(','):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        # isdigit() alone also accepts characters such as '²' that int() rejects
+        if not (chunk.isascii() and chunk.isdigit()):
+            raise APIException("Invalid id: " + chunk, status_code=400)
+        if int(chunk) not in ids:
+            ids.append(int(chunk))
+    if len(ids) > max_ids:
+        raise APIException("Too many ids, max is " + str(max_ids), status_code=400)
+    return ids
+
+def get_many(model, ids):
+    # One SELECT ... WHERE id IN (...), returned in the requested order
+    rows = model.query.filter(model.id.in_(ids)).all() if ids else []
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+def parse_expand(value, allowed):
+    fields = [field.strip() for field in (value or '').split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise APIException("Cannot expand: " + ", ".join(unknown), status_code=400)
+    return fields
+
+def serialize_favorites(favorites, expand=(), related=None):
+    # Load every referenced entity with one IN query per type. Besides feeding
+    # ?expand, this fills the session identity map so the *_name lookups in
+    # Favorite.serialize() do not lazy-load one row per favorite.
+    related = related or {}
+    loaded = {}
+    for field, model in related.items():
+        ids = list({getattr(fav, field + '_id') for fav in favorites} - {None})
+        loaded[field] = {row.id: row for row in get_many(model, ids)}
+
+    results = []
+    for fav in favorites:
+        item = fav.serialize()
+        for field in expand:
+            entity = loaded[field].get(getattr(fav, field + '_id'))
+            item[field] = entity.serialize() if entity else None
+        results.append(item)
+    return results
+
+def stream_favorites(expand=(), related=None, chunk_size=500, **filters):
+    # Streams a JSON array page by page using keyset pagination on id. Each
+    # page is its own short query, so no server-side cursor stays open while
+    # the related rows are loaded. On a partitioned table PostgreSQL answers
+    # every page with a Merge Append across the partitions' primary keys.
+    # The query is built here, not by the view: stream_with_context pushes the
+    # same request context again, but teardown (and its db.session.remove())
+    # already ran when the view returned, so the generator gets a new session.
+    yield '['
+    last_id = 0
+    first = True
+    while True:
+        page = Favorite.query.filter_by(**filters).filter(Favorite.id > last_id).order_by(Favorite.id).limit(chunk_size).all()
+        if not page:
+            break
+        for item in serialize_favorites(page, expand, related):
+            yield ('' if first else ',') + current_app.json.dumps(item)
+            first = False
+        last_id = page[-1].id
+        db.session.expunge_all()
+    yield ']\n'
+
+def favorite_ids(user_id):
+    # {'people': {...}, 'planet': {...}, 'vehicle': {...}} for one user, loaded
+    # with a single query and kept on `g` for the rest of the request.
+    cache = g.setdefault('favorite_ids', {})
+    if user_id not in cache:
+        sets = {'people': set(), 'planet': set(), 'vehicle': set()}
+        rows = db.session.query(Favorite.people_id, Favorite.planet_id, Favorite.vehicle_id) \
+            .filter_by(user_id=user_id).all()
+        for people_id, planet_id, vehicle_id in rows:
+            sets['people'].add(people_id)
+            sets['planet'].add(planet_id)
+            sets['vehicle'].add(vehicle_id)
+        for ids in sets.values():
+            ids.discard(None)
+        cache[user_id] = sets
+    return cache[user_id]
+
+def annotate_favorites(items, kind, user_id):
+    ids = favorite_ids(user_id)[kind]
+    for item in items:
+        item['is_favorite'] = item['id'] in ids
+    return items
+
+def parse_user_arg(value):
+    if value is None:
+        return None
+    if not (value.isascii() and value.isdigit()):
+        raise APIException("Invalid user id: " + value, status_code=400)
+    return int(value)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -39,3 +141,15 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+def cached_response(key, build, mimetype):
+    # Builds the body once per process and serves it from memory with an
+    # ETag, so conditional requests get a bodiless 304.
+    cache = current_app.extensions.setdefault('response_cache', {})
+    if key not in cache:
+        body = build()
+        cache[key] = (body, hashlib.sha1(body.encode('utf-8')).hexdigest())
+    body, etag = cache[key]
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
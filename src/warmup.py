@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+import time
+from flask import jsonify
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Cheap requests that go through the same code paths (routing, query
+# compilation, serialization, templates) as the hot endpoints
+WARMUP_URLS = (
+    '/',
+    '/openapi.json',
+    '/people/0',
+    '/planets/0',
+    '/vehicles/0',
+    '/users/0',
+    '/users/0/favorites',
+    '/people?ids=0',
+    '/planets?ids=0',
+    '/vehicles?ids=0',
+    '/admin/',
+)
+
+
+def warm_up(app):
+    """Prepare this worker before it reports ready on /readyz.
+
+    Opens the connection pool, configures the mappers and runs one request
+    against each hot endpoint so SQLAlchemy's statement cache, Jinja (for
+    Flask-Admin) and the cached sitemap/OpenAPI responses are all primed.
+    Run it after the fork (gunicorn without --preload does that, since each
+    worker imports wsgi.py itself): pooled connections must not be shared
+    across processes.
+    """
+    state = app.extensions['warmup']
+    state['started'] = True
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            configure_mappers()
+            engine = db.engine
+            size = getattr(engine.pool, 'size', lambda: 1)()
+            connections = [engine.connect() for _ in range(min(size, app.config['WARMUP_CONNECTIONS']))]
+            for conn in connections:
+                conn.close()
+
+        client = app.test_client()
+        for url in WARMUP_URLS:
+            client.get(url, environ_base={'starwars.warmup': True})
+    except Exception:
+        # A worker that cannot reach the database is still alive; /readyz
+        # keeps reporting it as not ready until the database answers.
+        logger.exception('Warm-up failed')
+    state['ready'] = True
+    logger.info('Worker %d warmed up in %.0f ms', os.getpid(), (time.perf_counter() - start) * 1000)
+
+
+def setup_health(app):
+    app.config.setdefault('WARMUP_CONNECTIONS', int(os.getenv('WARMUP_CONNECTIONS', 5)))
+    app.config.setdefault('READY_CACHE_SECONDS', float(os.getenv('READY_CACHE_SECONDS', 5)))
+    state = app.extensions.setdefault('warmup', {'started': False, 'ready': False})
+    lock = threading.Lock()
+    cached = {'ok': False, 'checked': 0.0}
+
+    # Liveness: the process is up and serving requests
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        return jsonify({"status": "ok"}), 200
+
+    # Readiness: warmed up and the database answered recently
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        if not state['ready']:
+            with lock:
+                if not state['started']:
+                    # Dev server / `flask run`: nothing called warm_up() yet
+                    threading.Thread(target=warm_up, args=(app,), daemon=True).start()
+                    state['started'] = True
+            return jsonify({"status": "warming up"}), 503
+
+        now = time.monotonic()
+        if now - cached['checked'] > app.config['READY_CACHE_SECONDS']:
+            with lock:
+                if now - cached['checked'] > app.config['READY_CACHE_SECONDS']:
+                    try:
+                        db.session.execute(text('SELECT 1'))
+                        cached['ok'] = True
+                    except Exception:
+                        db.session.rollback()
+                        cached['ok'] = False
+                    cached['checked'] = now
+        if not cached['ok']:
+            return jsonify({"status": "database unavailable"}), 503
+        return jsonify({"status": "ready"}), 200
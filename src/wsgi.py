@@ -1,7 +1,15 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
+import os
 from app import app as application
+from warmup import warm_up
+
+# Each gunicorn worker imports this module after forking, so the worker is
+# warmed up (pool, mappers, statement cache) before it accepts requests.
+# Set WARMUP=0 to skip it.
+if os.getenv('WARMUP', '1') != '0':
+    warm_up(application)
 
 if __name__ == "__main__":
     application.run()